@@ -1,20 +1,54 @@
 # database.py
+import atexit
 import sqlite3
+import threading
 from contextlib import contextmanager
+from functools import lru_cache
+
+# A single connection is opened once and shared, instead of reconnecting on every query.
+# isolation_level=None lets get_db_connection() manage transactions explicitly.
+_CONN = sqlite3.connect("student_portal.db", check_same_thread=False, isolation_level=None)
+_LOCK = threading.RLock()
+_CONN.execute("PRAGMA journal_mode=WAL")
+_CONN.execute("PRAGMA synchronous=NORMAL")
+_CONN.execute("PRAGMA temp_store=MEMORY")
+_CONN.execute("PRAGMA cache_size=-64000")
+atexit.register(_CONN.close)
+
+# Hot queries. sqlite3 keeps a per-connection cache of prepared statements keyed by
+# SQL text, so on the shared connection these are compiled once and reused.
+_STMT_USER_ROLE = "SELECT role FROM users WHERE username = ?"
+
+_DEPTH = 0  # Nesting level of get_db_connection(); only touched while holding _LOCK
 
 @contextmanager
 def get_db_connection():
-    """Context manager for database connection."""
-    conn = sqlite3.connect("student_portal.db")
-    cursor = conn.cursor()
-    try:
-        yield cursor
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    """Context manager yielding a cursor on the shared connection inside a transaction.
+
+    Nested calls on the same thread run inside a SAVEPOINT of the outer transaction.
+    """
+    global _DEPTH
+    with _LOCK:
+        cursor = _CONN.cursor()
+        savepoint = f"sp{_DEPTH}" if _DEPTH else None
+        _CONN.execute(f"SAVEPOINT {savepoint}" if savepoint else "BEGIN")
+        _DEPTH += 1
+        committed = False
+        try:
+            yield cursor
+            _CONN.execute(f"RELEASE {savepoint}" if savepoint else "COMMIT")
+            committed = True
+        finally:
+            _DEPTH -= 1
+            cursor.close()
+            # Runs for any exit without commit, including BaseExceptions such as
+            # Streamlit's st.stop()/st.rerun(), so the shared connection is never left mid-transaction
+            if not committed:
+                if savepoint:
+                    _CONN.execute(f"ROLLBACK TO {savepoint}")
+                    _CONN.execute(f"RELEASE {savepoint}")
+                elif _CONN.in_transaction:
+                    _CONN.execute("ROLLBACK")
 
 def setup_database():
     """Sets up the database schema (tables) and populates initial data."""
@@ -75,21 +109,34 @@ def setup_database():
             )
         """)
 
-        # Insert initial courses if they don't exist
-        for course_name in ["Python", "Typescript", "Next.js"]:
-            cursor.execute("INSERT OR IGNORE INTO courses (name) VALUES (?)", (course_name,))
-        # Insert initial teachers if they don't exist
-        for teacher_name in ["Sir Zia", "Madam Hira", "Sir Inam"]:
-            cursor.execute("INSERT OR IGNORE INTO teachers (name) VALUES (?)", (teacher_name,))
-        
-        # Insert default admin and student users if they don't exist
-        cursor.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", ("admin", "admin123", "admin"))
-        cursor.execute("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", ("student", "student123", "student"))
+        # Index foreign-key and lookup columns (SQLite does not index FKs automatically).
+        # attendance(student_id, time_in) also serves plain student_id lookups.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_user_id ON students(user_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_course_id ON students(course_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_favorite_teacher_id ON students(favorite_teacher_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_student_id_time_in ON attendance(student_id, time_in)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_student_id ON results(student_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username_role ON users(username, role)")
+
+        # Seed initial data in batches; get_db_connection() already wraps the whole
+        # setup in a single transaction, so schema and seeds commit together.
+        courses = [("Python",), ("Typescript",), ("Next.js",)]
+        teachers = [("Sir Zia",), ("Madam Hira",), ("Sir Inam",)]
+        users = [("admin", "admin123", "admin"), ("student", "student123", "student")]
+        cursor.executemany("INSERT OR IGNORE INTO courses (name) VALUES (?)", courses)
+        cursor.executemany("INSERT OR IGNORE INTO teachers (name) VALUES (?)", teachers)
+        cursor.executemany("INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", users)
+    get_user_role.cache_clear()
 
+@lru_cache(maxsize=256)
 def get_user_role(username):
-    """Retrieves the role of a user from the database."""
+    """Retrieves the role of a user from the database.
+
+    Results are memoized; any code that creates users or changes a role must
+    call get_user_role.cache_clear() afterwards.
+    """
     with get_db_connection() as cursor:
-        cursor.execute("SELECT role FROM users WHERE username = ?", (username,))
+        cursor.execute(_STMT_USER_ROLE, (username,))
         result = cursor.fetchone()
         if result:
             return result[0]
@@ -1,38 +1,90 @@
 # features.py
 import random
 import datetime
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont # type: ignore
+from PIL import features as pil_features # type: ignore
 import qrcode # type: ignore
 from io import BytesIO
 import streamlit as st # type: ignore # Streamlit is needed for st.error in case of font loading issues
 import numpy as np # type: ignore # Needed for face_recognition encodings
 
 # --- Face Recognition (REAL) ---
+# face_recognition pulls in dlib, so it is only imported the first time a face feature is used
+_FR = None
+FACE_RECOGNITION_AVAILABLE = None  # Unknown until _fr() has been called
+
+def _fr():
+    """Returns the face_recognition module, importing it on first use, or None if it is not installed."""
+    global _FR, FACE_RECOGNITION_AVAILABLE
+    if FACE_RECOGNITION_AVAILABLE is None:
+        try:
+            import face_recognition as _FR # type: ignore
+            FACE_RECOGNITION_AVAILABLE = True
+        except ImportError:
+            FACE_RECOGNITION_AVAILABLE = False
+            st.warning("Face recognition library (face_recognition) not found. Face features will be simulated.")
+    return _FR
+
 try:
-    import face_recognition # type: ignore
-    FACE_RECOGNITION_AVAILABLE = True
+    import blosc # type: ignore
+    BLOSC_AVAILABLE = True
 except ImportError:
-    FACE_RECOGNITION_AVAILABLE = False
-    st.warning("Face recognition library (face_recognition) not found. Face features will be simulated.")
+    BLOSC_AVAILABLE = False
+
+# Face encoding BLOBs start with a 1-byte format tag
+_ENCODING_RAW = b"\x00"    # raw float32 bytes
+_ENCODING_BLOSC = b"\x01"  # blosc (lz4 + shuffle) compressed float32 bytes
+
+def pack_face_encoding(face_encoding):
+    """Converts a face encoding into the tagged BLOB stored in students.face_encoding."""
+    data = np.ascontiguousarray(face_encoding, dtype=np.float32).tobytes()
+    if BLOSC_AVAILABLE:
+        compressed = blosc.compress(data, typesize=4, cname='lz4', shuffle=blosc.SHUFFLE)
+        # Typical dlib encodings do not compress, and blosc adds a 16-byte header
+        if len(compressed) < len(data):
+            return _ENCODING_BLOSC + compressed
+    return _ENCODING_RAW + data
+
+# Rows written before the format tag hold the original untagged 128-d float64 bytes.
+# Tagged BLOBs are at most 1 + 512 bytes, so this length cannot collide with them.
+_LEGACY_FLOAT64_SIZE = 128 * 8
+
+def unpack_face_encoding(face_encoding_bytes):
+    """Converts a stored face encoding BLOB back into a float32 numpy array."""
+    if len(face_encoding_bytes) == _LEGACY_FLOAT64_SIZE:
+        return np.frombuffer(face_encoding_bytes, dtype=np.float64).astype(np.float32)
+    tag, data = face_encoding_bytes[:1], face_encoding_bytes[1:]
+    if tag == _ENCODING_BLOSC:
+        if not BLOSC_AVAILABLE:
+            raise RuntimeError("Face encoding is blosc-compressed but the blosc library is not installed.")
+        data = blosc.decompress(data)
+    return np.frombuffer(data, dtype=np.float32)
 
 def get_face_encoding_from_photo(photo_bytes):
     """
     Loads an image from bytes, finds faces, and returns the first face encoding.
     Returns None if no face is found or if face_recognition is not available.
     """
-    if not FACE_RECOGNITION_AVAILABLE or not photo_bytes:
+    fr = _fr()
+    if fr is None or not photo_bytes:
         return None, "Face recognition is not available or no photo provided."
 
     try:
-        # Load the image from bytes
-        image = face_recognition.load_image_file(BytesIO(photo_bytes))
+        # Load the image from bytes, downscaled so face detection runs on fewer pixels
+        pil_image = Image.open(BytesIO(photo_bytes))
+        pil_image.thumbnail((500, 500), Image.BILINEAR)
+        image = np.asarray(pil_image.convert("RGB"))
         
         # Find all face encodings in the image
-        face_encodings = face_recognition.face_encodings(image)
+        face_encodings = fr.face_encodings(image)
 
         if len(face_encodings) > 0:
-            # Return the first face encoding found
-            return face_encodings[0], "Face encoding generated successfully."
+            # Return the first face encoding found, as float32 to halve its stored size
+            return face_encodings[0].astype(np.float32, copy=False), "Face encoding generated successfully."
         else:
             return None, "No face found in the uploaded photo."
     except Exception as e:
@@ -41,10 +93,10 @@ def get_face_encoding_from_photo(photo_bytes):
 def recognize_face(known_face_encoding_bytes, current_photo_bytes):
     """
     Compares a new photo against a known face encoding.
-    known_face_encoding_bytes: BLOB from DB (numpy array converted to bytes)
+    known_face_encoding_bytes: BLOB from DB (as produced by pack_face_encoding)
     current_photo_bytes: Bytes of the photo taken for attendance
     """
-    if not FACE_RECOGNITION_AVAILABLE:
+    if _fr() is None:
         return False, "Face recognition is not available."
 
     if not known_face_encoding_bytes:
@@ -54,8 +106,8 @@ def recognize_face(known_face_encoding_bytes, current_photo_bytes):
         return False, "No current photo provided for attendance."
 
     try:
-        # Convert known encoding from bytes back to numpy array
-        known_face_encoding = np.frombuffer(known_face_encoding_bytes)
+        # Convert known encoding from the stored BLOB back to numpy array
+        known_face_encoding = unpack_face_encoding(known_face_encoding_bytes)
 
         # Get encoding from the current attendance photo
         current_face_encodings, message = get_face_encoding_from_photo(current_photo_bytes)
@@ -63,11 +115,12 @@ def recognize_face(known_face_encoding_bytes, current_photo_bytes):
         if current_face_encodings is None:
             return False, f"Could not detect face in current photo: {message}"
 
-        # Compare faces
+        # Compare faces by euclidean distance, as face_recognition.compare_faces does
         # tolerance can be adjusted, smaller means stricter match
-        matches = face_recognition.compare_faces([known_face_encoding], current_face_encodings, tolerance=0.5) 
-        
-        if matches[0]: # If the first (and only) known face matches
+        dist = np.linalg.norm(known_face_encoding.reshape(1, -1) - current_face_encodings.reshape(1, -1), axis=1)[0]
+        matched = dist <= 0.5
+
+        if matched:
             return True, "Face recognized successfully."
         else:
             return False, "Face not recognized. Please try again."
@@ -75,6 +128,68 @@ def recognize_face(known_face_encoding_bytes, current_photo_bytes):
     except Exception as e:
         return False, f"Error during face recognition: {e}"
 
+# In-memory gallery of all registered encodings: (student ids, (N, 128) float32 matrix)
+_ENCODING_GALLERY = None
+
+def load_encoding_gallery():
+    """
+    Loads every registered student face encoding into memory once and returns (ids, encodings).
+    Call clear_encoding_gallery() whenever a student's face_encoding is inserted or updated.
+    """
+    global _ENCODING_GALLERY
+    if _ENCODING_GALLERY is None:
+        # Imported here so importing features does not open the database
+        from database import get_db_connection
+        with get_db_connection() as cursor:
+            cursor.execute("SELECT id, face_encoding FROM students WHERE face_encoding IS NOT NULL")
+            rows = cursor.fetchall()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        if rows:
+            encodings = np.stack([unpack_face_encoding(row[1]) for row in rows])
+        else:
+            encodings = np.empty((0, 128), dtype=np.float32)
+        _ENCODING_GALLERY = (ids, encodings)
+    return _ENCODING_GALLERY
+
+def clear_encoding_gallery():
+    """Drops the cached gallery so the next lookup reloads it from the database."""
+    global _ENCODING_GALLERY
+    _ENCODING_GALLERY = None
+
+def recognize_against_gallery(current_photo_bytes, tolerance=0.5):
+    """
+    Identifies which registered student appears in a photo.
+    Returns (student_id, message); student_id is None when no one matches.
+    """
+    if _fr() is None:
+        return None, "Face recognition is not available."
+
+    if not current_photo_bytes:
+        return None, "No current photo provided for attendance."
+
+    try:
+        ids, encodings = load_encoding_gallery()
+        if len(ids) == 0:
+            return None, "No registered face data found."
+
+        # Get encoding from the current attendance photo
+        current_face_encoding, message = get_face_encoding_from_photo(current_photo_bytes)
+
+        if current_face_encoding is None:
+            return None, f"Could not detect face in current photo: {message}"
+
+        # Distance from the query to every registered face in one vectorized pass
+        distances = np.linalg.norm(encodings - current_face_encoding, axis=1)
+        best = np.argmin(distances)
+
+        if distances[best] <= tolerance:
+            return int(ids[best]), "Face recognized successfully."
+        else:
+            return None, "Face not recognized. Please try again."
+
+    except Exception as e:
+        return None, f"Error during face recognition: {e}"
+
 # --- Payment Gateway (Dummy - Replace with a real integration) ---
 def process_payment(amount, token):
     """
@@ -92,75 +207,158 @@ def process_payment(amount, token):
         return "failure", "Invalid amount"
     
     # Simulate success/failure
-    status = random.choice(["success", "failure"])
+    status = "success" if random.getrandbits(1) else "failure"
     message = "Payment successful" if status == "success" else "Payment failed"
     return status, message
 
 # --- ID Card Generation ---
-def generate_id_card(student_data):
-    """Generates the student ID card image.
-
-    Args:
-        student_data (dict):  Dictionary containing student information.
-    """
-    # ID card dimensions
-    width = 800
-    height = 500
+# IMPORTANT: Place 'arial.ttf' in the same directory as this script,
+# or provide the full path to a font file on your system.
+FONT_PATH = "arial.ttf"
+
+@lru_cache(maxsize=16)
+def _get_font(size):
+    """Loads the ID card font at the given size once and reuses it across cards."""
+    return ImageFont.truetype(FONT_PATH, size)
+
+# ID card layout
+CARD_WIDTH = 800
+CARD_HEIGHT = 500
+BLUE = (0, 71, 171)
+BLACK = (0, 0, 0)
+LOGO_WIDTH = 100
+LOGO_HEIGHT = 100
+LOGO_X = 50
+LOGO_Y = 80
+INFO_X = LOGO_X + LOGO_WIDTH + 20
+INFO_Y = LOGO_Y
+LINE_HEIGHT = 30
+
+# (label, student_data key) for each row of the student information block
+_LABELS = (
+    ("Name:", "name"),
+    ("Roll No:", "roll_no"),
+    ("Email:", "email"),
+    ("Slot:", "slot"),
+    ("Contact:", "contact"),
+    ("Course:", "course"),
+    ("Teacher:", "favorite_teacher"),
+)
+
+@lru_cache(maxsize=1)
+def _get_q3_glyph():
+    """Rasterizes the "Q3" watermark once into an RGBA image cropped to the glyph bounds."""
+    q3_font = _get_font(100)  # Q3 font
+    q3_text = "Q3"
+    bbox = q3_font.getbbox(q3_text)
+    glyph = Image.new('RGBA', (bbox[2] - bbox[0], bbox[3] - bbox[1]), (0, 0, 0, 0))
+    ImageDraw.Draw(glyph).text((-bbox[0], -bbox[1]), q3_text, fill=(200, 200, 200, 255), font=q3_font)  # Light gray
+    return glyph
+
+@lru_cache(maxsize=1)
+def _get_template():
+    """Renders the parts of the ID card shared by every student (border, title, logo, Q3 watermark, labels) once."""
+    width = CARD_WIDTH
+    height = CARD_HEIGHT
+    title_font = _get_font(40)
+    header_font = _get_font(24)
 
     # Create a new image with white background
     img = Image.new('RGB', (width, height), color='white')
     draw = ImageDraw.Draw(img)
 
-    # Font settings
-    # IMPORTANT: Place 'arial.ttf' in the same directory as this script,
-    # or provide the full path to a font file on your system.
-    font_path = "arial.ttf"  
-    try:
-        title_font = ImageFont.truetype(font_path, 40)
-        header_font = ImageFont.truetype(font_path, 24)
-        text_font = ImageFont.truetype(font_path, 20)
-        q3_font = ImageFont.truetype(font_path, 100)  # Q3 font
-    except Exception as e:
-        # Use st.error here as this function might be called directly by Streamlit
-        st.error(f"Error loading font: {e}. Please make sure arial.ttf is in the same directory or provide the full path.")
-        return None
-
-    # Colors
-    blue = (0, 71, 171)
-    black = (0, 0, 0)
-
     # Add a border
     border_width = 5
-    draw.rectangle([(0, 0), (width - 1, height - 1)], outline=blue, width=border_width)
+    draw.rectangle([(0, 0), (width - 1, height - 1)], outline=BLUE, width=border_width)
 
     # Title
     title_text = "GIAIC Student ID Card"
     title_width = draw.textlength(title_text, font=title_font)
     title_x = (width - title_width) / 2
-    draw.text((title_x, 20), title_text, fill=blue, font=title_font)
+    draw.text((title_x, 20), title_text, fill=BLUE, font=title_font)
 
     # Add logo (dummy blue square)
-    logo_width = 100
-    logo_height = 100
-    logo_x = 50
-    logo_y = 80
-    logo_img = Image.new('RGB', (logo_width, logo_height), color=blue)
-    img.paste(logo_img, (logo_x, logo_y))
-
-    # Q3 watermark
-    q3_text = "Q3"
-    bbox = draw.textbbox((0, 0), q3_text, font=q3_font)
-    q3_width = bbox[2] - bbox[0]
-    q3_height = bbox[3] - bbox[1]
+    logo_img = Image.new('RGB', (LOGO_WIDTH, LOGO_HEIGHT), color=BLUE)
+    img.paste(logo_img, (LOGO_X, LOGO_Y))
+
+    # Q3 watermark, centered
+    q3_glyph = _get_q3_glyph()
+    q3_width, q3_height = q3_glyph.size
+
+    q3_x = (width - q3_width) // 2
+    q3_y = (height - q3_height) // 2
+    img.paste(q3_glyph, (q3_x, q3_y), q3_glyph)
+
+    # Student information labels
+    for row, (label, _) in enumerate(_LABELS):
+        draw.text((INFO_X, INFO_Y + row * LINE_HEIGHT), label, fill=BLACK, font=header_font)
 
-    q3_x = (width - q3_width) / 2
-    q3_y = (height - q3_height) / 2
-    draw.text((q3_x, q3_y), q3_text, fill=(200, 200, 200, 128), font=q3_font)  # Light gray with alpha
+    return img
 
-    # Student Information
-    start_x = logo_x + logo_width + 20
-    start_y = logo_y
-    line_height = 30
+# WebP cards are several times smaller than PNG; PNG remains available for old browsers
+# and Pillow builds without WebP support.
+WEBP_AVAILABLE = pil_features.check("webp")
+
+# Encoded ID cards keyed by student fields + photo digest, most recently used last
+_ID_CARD_CACHE = OrderedDict()
+_ID_CARD_CACHE_SIZE = 128
+_ID_CARD_CACHE_LOCK = threading.Lock()  # Streamlit runs sessions on several threads
+
+def clear_id_card_cache():
+    """Drops all cached ID cards. Call after a student's record is updated."""
+    with _ID_CARD_CACHE_LOCK:
+        _ID_CARD_CACHE.clear()
+
+def generate_id_card(student_data, image_format='WEBP'):
+    """Generates the student ID card image, reusing the encoded bytes when nothing on the card changed.
+
+    Args:
+        student_data (dict):  Dictionary containing student information.
+        image_format (str): 'WEBP' (default) or 'PNG'. Falls back to PNG when WebP is unavailable.
+    """
+    if image_format == 'WEBP' and not WEBP_AVAILABLE:
+        image_format = 'PNG'
+
+    photo_hash = hashlib.blake2b(student_data['photo'] or b'', digest_size=8).digest()
+    key = tuple(student_data[field] for _, field in _LABELS) + (
+        photo_hash, student_data.get('time_in'), student_data.get('time_out'), image_format)
+
+    with _ID_CARD_CACHE_LOCK:
+        img_bytes = _ID_CARD_CACHE.get(key)
+        if img_bytes is not None:
+            _ID_CARD_CACHE.move_to_end(key)
+            return img_bytes
+
+    # Render outside the lock so other sessions are not blocked meanwhile
+    img_bytes = _render_id_card(student_data, image_format)
+    if img_bytes is not None:
+        with _ID_CARD_CACHE_LOCK:
+            _ID_CARD_CACHE[key] = img_bytes
+            if len(_ID_CARD_CACHE) > _ID_CARD_CACHE_SIZE:
+                _ID_CARD_CACHE.popitem(last=False)
+    return img_bytes
+
+def _render_id_card(student_data, image_format):
+    """Renders the student ID card and returns it as image bytes in the given format."""
+    # ID card dimensions
+    width = CARD_WIDTH
+    height = CARD_HEIGHT
+
+    # Start from a copy of the pre-rendered static card
+    try:
+        img = _get_template().copy()
+    except Exception as e:
+        # Use st.error here as this function might be called directly by Streamlit
+        st.error(f"Error loading font: {e}. Please make sure arial.ttf is in the same directory or provide the full path.")
+        return None
+    draw = ImageDraw.Draw(img)
+
+    # Font settings
+    text_font = _get_font(20)
+
+    # Colors
+    blue = BLUE
+    black = BLACK
 
     # Student Photo
     photo_width = 120
@@ -170,7 +368,11 @@ def generate_id_card(student_data):
     if student_data['photo']:
         try:
             student_photo = Image.open(BytesIO(student_data['photo']))
-            student_photo = student_photo.resize((photo_width, photo_height))
+            # Let JPEG decode at reduced scale instead of decoding the full-size photo
+            student_photo.draft('RGB', (photo_width * 2, photo_height * 2))
+            student_photo = student_photo.convert('RGB')
+            student_photo.thumbnail((photo_width * 2, photo_height * 2), Image.LANCZOS)
+            student_photo = student_photo.resize((photo_width, photo_height), Image.LANCZOS)
             img.paste(student_photo, (photo_x, photo_y))
         except Exception as e:
             print(f"Error pasting photo: {e}")
@@ -182,38 +384,20 @@ def generate_id_card(student_data):
                         fill=blue)  # Placeholder
         draw.text((photo_x + 10, photo_y + 60), "Photo", fill=black, font=text_font)
 
-    draw.text((start_x, start_y), "Name:", fill=black, font=header_font)
-    draw.text((start_x + 150, start_y), student_data['name'], fill=black, font=text_font)
-
-    draw.text((start_x, start_y + line_height), "Roll No:", fill=black, font=header_font)
-    draw.text((start_x + 150, start_y + line_height), student_data['roll_no'], fill=black, font=text_font)
-
-    draw.text((start_x, start_y + 2 * line_height), "Email:", fill=black, font=header_font)
-    draw.text((start_x + 150, start_y + 2 * line_height), student_data['email'], fill=black, font=text_font)
-
-    draw.text((start_x, start_y + 3 * line_height), "Slot:", fill=black, font=header_font)
-    draw.text((start_x + 150, start_y + 3 * line_height), student_data['slot'], fill=black, font=text_font)
-
-    draw.text((start_x, start_y + 4 * line_height), "Contact:", fill=black, font=header_font)
-    draw.text((start_x + 150, start_y + 4 * line_height), student_data['contact'], fill=black, font=text_font)
-
-    draw.text((start_x, start_y + 5 * line_height), "Course:", fill=black, font=header_font)
-    draw.text((start_x + 150, start_y + 5 * line_height), student_data['course'], fill=black, font=text_font)
-
-    draw.text((start_x, start_y + 6 * line_height), "Teacher:", fill=black, font=header_font)
-    draw.text((start_x + 150, start_y + 6 * line_height), student_data['favorite_teacher'], fill=black,
-              font=text_font)
+    # Student Information (labels are already on the template)
+    for row, (_, key) in enumerate(_LABELS):
+        draw.text((INFO_X + 150, INFO_Y + row * LINE_HEIGHT), student_data[key], fill=black, font=text_font)
 
     # Add QR code
     qr_data = f"Name: {student_data['name']}, Roll No: {student_data['roll_no']}, Email: {student_data['email']}, Course: {student_data['course']}"
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr = qrcode.QRCode(version=1, box_size=4, border=2)
     qr.add_data(qr_data)
     qr.make(fit=True)
-    qr_img = qr.make_image(fill_color=blue, back_color="white")
+    qr_img = qr.make_image(fill_color=blue, back_color="white").convert('RGB')
 
     qr_width, qr_height = qr_img.size
     qr_x = width - qr_width - 50
-    qr_y = height - qr_height - 250  # Adjusted y position
+    qr_y = height - qr_height - 30  # Bottom-right corner, below the photo
     img.paste(qr_img, (qr_x, qr_y))
 
     # Add time in and time out
@@ -226,6 +410,9 @@ def generate_id_card(student_data):
 
     # Convert the image to bytes for Streamlit display
     img_bytes = BytesIO()
-    img.save(img_bytes, format='PNG')
+    if image_format == 'WEBP':
+        img.save(img_bytes, format='WEBP', quality=85, method=4)
+    else:
+        img.save(img_bytes, format='PNG')
     img_bytes = img_bytes.getvalue()
     return img_bytes
\ No newline at end of file